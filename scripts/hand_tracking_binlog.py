@@ -0,0 +1,113 @@
+"""
+Fixed-size binary record format for hand tracking logs.
+Each /control message is stored as one packed little-endian record so logs
+can be written and read back without any JSON encoding or float parsing.
+"""
+
+import math
+import struct
+from typing import Dict, Any, Iterator
+
+NUM_JOINTS = 26
+HANDS = ('leftHand', 'rightHand')
+
+# File header: magic + format version
+HEADER = struct.Struct('<4sI')
+MAGIC = b'HTBL'
+VERSION = 2
+
+# Record layout:
+#   server_timestamp  f8
+#   message_index     u4   server-assigned index, kept even if records are dropped
+#   timestamp         f8   client timestamp, NaN when absent
+#   hands             u1   bit 0 = leftHand present, bit 1 = rightHand present
+#   masks             2 x u4   trackedMask per hand (left, right)
+#   joints            2 x 26 x 3 f4   joint positions per hand (left, right)
+RECORD = struct.Struct(f'<dIdBII{NUM_JOINTS * 3 * 2}f')
+
+_EMPTY_JOINTS = (0.0,) * (NUM_JOINTS * 3)
+
+# Largest values that fit the u4 mask and f4 joint fields
+MAX_MASK = 0xFFFFFFFF
+MAX_FLOAT32 = 3.4028234663852886e38
+
+def encode_header() -> bytes:
+    """Return the header written at the start of every binary log."""
+    return HEADER.pack(MAGIC, VERSION)
+
+def check_frame(data: Dict[str, Any]):
+    """Raise ValueError if a /control payload does not fit the fixed record layout."""
+    for key in HANDS:
+        hand = data.get(key)
+        if not hand:
+            continue
+        if len(hand['joints']) != NUM_JOINTS:
+            raise ValueError(f"{key} has {len(hand['joints'])} joints, expected {NUM_JOINTS}")
+        if not 0 <= hand.get('trackedMask', 0) <= MAX_MASK:
+            raise ValueError(f"{key} trackedMask does not fit in 32 bits")
+        if any(abs(c) > MAX_FLOAT32 for joint in hand['joints'] for c in joint):
+            raise ValueError(f"{key} has joint coordinates out of float32 range")
+
+def encode_record(server_timestamp: float, message_index: int, data: Dict[str, Any]) -> bytes:
+    """Pack a /control payload into a fixed-size record.
+
+    The payload must already have passed check_frame().
+    """
+    timestamp = data.get('timestamp')
+    present = 0
+    masks = []
+    joints = []
+    for bit, key in enumerate(HANDS):
+        hand = data.get(key)
+        if not hand:
+            masks.append(0)
+            joints.append(_EMPTY_JOINTS)
+            continue
+        hand_joints = hand['joints']
+        present |= 1 << bit
+        masks.append(hand.get('trackedMask', 0))
+        joints.append([c for joint in hand_joints for c in joint])
+
+    return RECORD.pack(
+        server_timestamp,
+        message_index,
+        math.nan if timestamp is None else timestamp,
+        present,
+        *masks,
+        *joints[0],
+        *joints[1]
+    )
+
+def _decode(fields: tuple) -> Dict[str, Any]:
+    server_timestamp, message_index, timestamp, present, left_mask, right_mask = fields[:6]
+    data: Dict[str, Any] = {}
+    if not math.isnan(timestamp):
+        data['timestamp'] = timestamp
+
+    masks = (left_mask, right_mask)
+    offset = 6
+    for bit, key in enumerate(HANDS):
+        if present & (1 << bit):
+            flat = fields[offset:offset + NUM_JOINTS * 3]
+            data[key] = {
+                'trackedMask': masks[bit],
+                'joints': [list(flat[j:j + 3]) for j in range(0, len(flat), 3)]
+            }
+        offset += NUM_JOINTS * 3
+
+    return {"server_timestamp": server_timestamp, "message_index": message_index, "data": data}
+
+def iter_records(buf: bytes) -> Iterator[Dict[str, Any]]:
+    """Decode a binary log into log entries shaped like the JSON log."""
+    magic, version = HEADER.unpack_from(buf)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Not a version {VERSION} binary hand tracking log")
+
+    body = memoryview(buf)[HEADER.size:]
+    usable = len(body) - len(body) % RECORD.size
+    for fields in RECORD.iter_unpack(body[:usable]):
+        yield _decode(fields)
+
+def record_count(file_size: int) -> int:
+    """Number of complete records in a binary log of the given size."""
+    return max(file_size - HEADER.size, 0) // RECORD.size
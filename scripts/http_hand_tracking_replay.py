@@ -4,15 +4,19 @@ Replay hand tracking log files by sending the data to an HTTP server.
 Maintains original timing between messages.
 """
 
-import json
+import asyncio
 import logging
-import time
 import argparse
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 from typing import Dict, Any, List
-import requests
+import httpx
+import msgspec
+import orjson
 from datetime import datetime
 
+import hand_tracking_binlog as binlog
+
 # Setup logging
 logging.basicConfig(
     level=logging.INFO,
@@ -20,32 +24,96 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+LOG_PATTERNS = ("hand_tracking_*.json", "hand_tracking_*.bin")
+
+def join_json(bodies: List[bytes]) -> bytes:
+    """Combine encoded JSON messages into a JSON array."""
+    return b'[' + b','.join(bodies) + b']'
+
+def join_msgpack(bodies: List[bytes]) -> bytes:
+    """Combine encoded MessagePack messages into a MessagePack array."""
+    n = len(bodies)
+    if n < 16:
+        header = bytes((0x90 | n,))
+    elif n < 0x10000:
+        header = b'\xdc' + n.to_bytes(2, 'big')
+    else:
+        header = b'\xdd' + n.to_bytes(4, 'big')
+    return header + b''.join(bodies)
+
+# Request body encoders, array joiners and content types per --format
+BODY_FORMATS = {
+    'json': (orjson.dumps, join_json, 'application/json'),
+    'msgpack': (msgspec.msgpack.encode, join_msgpack, 'application/msgpack'),
+}
+
+# Messages batched into one POST may span at most this much (scaled) replay time
+BATCH_WINDOW = 0.02
+
+def find_log_files(log_dir: Path) -> List[Path]:
+    """Return JSON and binary log files sorted by name (i.e. by start time)."""
+    return sorted(
+        (f for pattern in LOG_PATTERNS for f in log_dir.glob(pattern)),
+        key=lambda f: f.name
+    )
+
+def count_messages(log_file: Path, file_size: int) -> int:
+    """Count data entries in a log file without decoding any JSON."""
+    if log_file.suffix == '.bin':
+        # Fixed-size records: the count follows from the file size alone
+        return binlog.record_count(file_size)
+    try:
+        return log_file.read_bytes().count(b'"data":')
+    except OSError:
+        return 0
+
 class HandTrackingReplay:
-    def __init__(self, server_url: str = "http://localhost:5000"):
+    def __init__(self, server_url: str = "http://localhost:5000", max_in_flight: int = 1,
+                 body_format: str = "json"):
         self.server_url = server_url.rstrip('/')
-        self.session = requests.Session()
+        self.control_url = f"{self.server_url}/control"
+        self.batch_url = f"{self.server_url}/control/batch"
+        self.max_in_flight = max_in_flight
+        self.encode, self.join, content_type = BODY_FORMATS[body_format]
+        
+        # One keep-alive connection per in-flight slot. With a single slot every
+        # message goes out over the same connection, so the server sees them in order
+        self.client = httpx.AsyncClient(
+            limits=httpx.Limits(max_keepalive_connections=max_in_flight, max_connections=max_in_flight),
+            headers={'Content-Type': content_type}
+        )
+        
+    async def close(self):
+        """Close the underlying HTTP client."""
+        await self.client.aclose()
         
     def load_log_file(self, log_path: Path) -> List[Dict[str, Any]]:
         """Load and parse a log file."""
         if not log_path.exists():
             raise FileNotFoundError(f"Log file not found: {log_path}")
             
+        if log_path.suffix == '.bin':
+            entries = list(binlog.iter_records(log_path.read_bytes()))
+            logger.info(f"Loaded {len(entries)} entries from {log_path}")
+            return entries
+            
+        # Read the whole file in one call and decode each line with orjson
         entries = []
-        with open(log_path, 'r') as f:
-            for line in f:
-                try:
-                    entry = json.loads(line.strip())
-                    entries.append(entry)
-                except json.JSONDecodeError as e:
-                    logger.warning(f"Failed to parse line: {e}")
+        for line in log_path.read_bytes().splitlines():
+            if not line.strip():
+                continue
+            try:
+                entries.append(orjson.loads(line))
+            except orjson.JSONDecodeError as e:
+                logger.warning(f"Failed to parse line: {e}")
                     
         logger.info(f"Loaded {len(entries)} entries from {log_path}")
         return entries
         
-    def check_server_health(self) -> bool:
+    async def check_server_health(self) -> bool:
         """Check if the server is healthy."""
         try:
-            response = self.session.get(f"{self.server_url}/health", timeout=2)
+            response = await self.client.get(f"{self.server_url}/health", timeout=2)
             if response.status_code == 200:
                 data = response.json()
                 logger.info(f"Server is healthy: {data}")
@@ -54,8 +122,32 @@ class HandTrackingReplay:
             logger.error(f"Server health check failed: {e}")
         return False
         
-    def replay_log(self, log_path: Path, speed: float = 1.0, loop: bool = False):
-        """Replay a log file."""
+    async def _send(self, url: str, body: bytes, first: int, last: int, total: int,
+                    semaphore: asyncio.Semaphore):
+        """Send messages first..last in one request and release its in-flight slot."""
+        try:
+            response = await self.client.post(
+                url,
+                content=body,
+                timeout=1
+            )
+            
+            if response.status_code == 200:
+                # Print progress whenever a multiple of 10 messages is reached
+                if first == 0 or (last + 1) // 10 > first // 10:
+                    progress = (last + 1) / total * 100
+                    logger.info(f"Progress: {last+1}/{total} ({progress:.1f}%)")
+            else:
+                logger.error(f"Server returned {response.status_code}: {response.text}")
+                
+        except httpx.HTTPError as e:
+            logger.error(f"Failed to send message {first+1}: {e}")
+        finally:
+            semaphore.release()
+            
+    async def replay_log(self, log_path: Path, speed: float = 1.0, loop: bool = False,
+                         batch_size: int = 1):
+        """Replay a log file, optionally posting up to batch_size messages per request."""
         entries = self.load_log_file(log_path)
         
         # Filter out metadata entries and get data entries
@@ -75,6 +167,32 @@ class HandTrackingReplay:
                 
         logger.info(f"Replaying {len(data_entries)} messages at {speed}x speed")
         
+        # Serialize each payload once and compute send offsets for all iterations
+        bodies = [self.encode(e['data']) for e in data_entries]
+        first_timestamp = data_entries[0]['server_timestamp']
+        offsets = [(e['server_timestamp'] - first_timestamp) / speed for e in data_entries]
+        
+        # Each send is (offset, url, body, first index, last index)
+        total = len(data_entries)
+        if batch_size > 1:
+            sends = []
+            start = 0
+            while start < total:
+                end = start + 1
+                while (end < total and end - start < batch_size
+                       and offsets[end] - offsets[start] <= BATCH_WINDOW):
+                    end += 1
+                body = self.join(bodies[start:end])
+                sends.append((offsets[start], self.batch_url, body, start, end - 1))
+                start = end
+            logger.info(f"Sending in {len(sends)} batches of up to {batch_size} messages")
+        else:
+            sends = [(offset, self.control_url, body, i, i)
+                     for i, (offset, body) in enumerate(zip(offsets, bodies))]
+        
+        semaphore = asyncio.Semaphore(self.max_in_flight)
+        event_loop = asyncio.get_running_loop()
+        
         iteration = 0
         while True:
             iteration += 1
@@ -83,74 +201,86 @@ class HandTrackingReplay:
             else:
                 logger.info(f"Starting replay iteration {iteration}...")
                 
-            start_time = time.time()
-            first_timestamp = data_entries[0]['server_timestamp']
+            start_time = event_loop.time()
+            pending = set()
             
-            for i, entry in enumerate(data_entries):
-                # Calculate delay based on original timing
-                original_delay = entry['server_timestamp'] - first_timestamp
-                scaled_delay = original_delay / speed
-                current_elapsed = time.time() - start_time
-                
-                # Wait if needed
-                if scaled_delay > current_elapsed:
-                    time.sleep(scaled_delay - current_elapsed)
+            for offset, url, body, first, last in sends:
+                # Wait until this message's deadline based on original timing
+                remaining = start_time + offset - event_loop.time()
+                if remaining > 0:
+                    await asyncio.sleep(remaining)
                     
-                # Send the data
-                try:
-                    response = self.session.post(
-                        f"{self.server_url}/control",
-                        json=entry['data'],
-                        timeout=1
-                    )
-                    
-                    if response.status_code == 200:
-                        # Print progress
-                        if (i + 1) % 10 == 0 or i == 0:
-                            progress = (i + 1) / len(data_entries) * 100
-                            logger.info(f"Progress: {i+1}/{len(data_entries)} ({progress:.1f}%)")
-                    else:
-                        logger.error(f"Server returned {response.status_code}: {response.text}")
-                        
-                except requests.exceptions.RequestException as e:
-                    logger.error(f"Failed to send message {i+1}: {e}")
-                    
-            total_time = time.time() - start_time
+                # Send the data without waiting for the response
+                await semaphore.acquire()
+                task = asyncio.create_task(self._send(url, body, first, last, total, semaphore))
+                pending.add(task)
+                task.add_done_callback(pending.discard)
+                
+            if pending:
+                await asyncio.gather(*pending)
+                
+            total_time = event_loop.time() - start_time
             logger.info(f"Replay completed in {total_time:.2f}s")
             
             if not loop:
                 break
                 
             logger.info("Waiting 2 seconds before next iteration...")
-            time.sleep(2)
+            await asyncio.sleep(2)
             
     def list_logs(self, log_dir: Path):
         """List available log files."""
-        log_files = sorted(log_dir.glob("hand_tracking_*.json"))
+        log_files = find_log_files(log_dir)
         
         if not log_files:
             logger.info("No log files found")
             return
             
+        # Get file info with a single stat per file
+        stats = [log_file.stat() for log_file in log_files]
+        
+        # Count messages in all files concurrently; file reads release the GIL
+        with ThreadPoolExecutor() as executor:
+            message_counts = list(executor.map(count_messages, log_files, [st.st_size for st in stats]))
+            
         logger.info(f"Found {len(log_files)} log files:")
-        for i, log_file in enumerate(log_files):
-            # Get file info
-            size = log_file.stat().st_size / 1024  # KB
-            modified = datetime.fromtimestamp(log_file.stat().st_mtime)
+        for i, (log_file, st, message_count) in enumerate(zip(log_files, stats, message_counts)):
+            size = st.st_size / 1024  # KB
+            modified = datetime.fromtimestamp(st.st_mtime)
             
-            # Try to read message count
-            message_count = 0
-            try:
-                with open(log_file, 'r') as f:
-                    for line in f:
-                        entry = json.loads(line)
-                        if entry.get('data'):
-                            message_count += 1
-            except:
-                pass
-                
             print(f"{i+1}. {log_file.name} - {size:.1f}KB, {message_count} messages, {modified.strftime('%Y-%m-%d %H:%M:%S')}")
 
+async def run_replay(args: argparse.Namespace):
+    replay = HandTrackingReplay(server_url=args.server, max_in_flight=args.max_in_flight,
+                                body_format=args.format)
+    try:
+        log_dir = Path(args.log_dir)
+        
+        # Check server health first
+        if not await replay.check_server_health():
+            logger.error("Server is not responding. Please check the server is running.")
+            return
+        
+        # Determine which log file to use
+        if args.latest:
+            log_files = find_log_files(log_dir)
+            if not log_files:
+                logger.error("No log files found")
+                return
+            log_path = log_files[-1]
+            logger.info(f"Using latest log file: {log_path}")
+        elif args.log_file:
+            log_path = Path(args.log_file)
+        else:
+            logger.error("Please specify --log-file or use --latest")
+            return
+        
+        # Start replay
+        await replay.replay_log(log_path, speed=args.speed, loop=args.loop,
+                                batch_size=args.batch_size)
+    finally:
+        await replay.close()
+
 def main():
     parser = argparse.ArgumentParser(description="Replay hand tracking logs via HTTP")
     parser.add_argument('action', choices=['replay', 'list'], help='Action to perform')
@@ -160,38 +290,23 @@ def main():
     parser.add_argument('--speed', type=float, default=1.0, help='Playback speed multiplier')
     parser.add_argument('--loop', action='store_true', help='Loop the replay continuously')
     parser.add_argument('--latest', action='store_true', help='Use the latest log file')
+    parser.add_argument('--format', choices=sorted(BODY_FORMATS), default='json',
+                        help='Request body encoding (msgpack needs a server that accepts it)')
+    parser.add_argument('--max-in-flight', type=int, default=1,
+                        help='Concurrent requests; values above 1 may deliver messages out of order')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='Post up to this many messages per request to /control/batch')
     
     args = parser.parse_args()
-    
-    replay = HandTrackingReplay(server_url=args.server)
-    log_dir = Path(args.log_dir)
+    if args.max_in_flight < 1:
+        parser.error('--max-in-flight must be at least 1')
     
     if args.action == 'list':
-        replay.list_logs(log_dir)
-        return
-        
-    # Check server health first
-    if not replay.check_server_health():
-        logger.error("Server is not responding. Please check the server is running.")
-        return
-        
-    # Determine which log file to use
-    if args.latest:
-        log_files = sorted(log_dir.glob("hand_tracking_*.json"))
-        if not log_files:
-            logger.error("No log files found")
-            return
-        log_path = log_files[-1]
-        logger.info(f"Using latest log file: {log_path}")
-    elif args.log_file:
-        log_path = Path(args.log_file)
-    else:
-        logger.error("Please specify --log-file or use --latest")
+        HandTrackingReplay(server_url=args.server).list_logs(Path(args.log_dir))
         return
         
-    # Start replay
     try:
-        replay.replay_log(log_path, speed=args.speed, loop=args.loop)
+        asyncio.run(run_replay(args))
     except KeyboardInterrupt:
         logger.info("Replay interrupted by user")
 
@@ -4,16 +4,25 @@ HTTP server for receiving hand tracking data from Vision Pro.
 Logs all received data with timestamps for later replay.
 """
 
-import json
+import asyncio
+import atexit
+import functools
 import logging
+import queue
+import threading
 import time
+from contextlib import asynccontextmanager
 from datetime import datetime
 from pathlib import Path
-from typing import Dict, Any, Optional
+from typing import Dict, Any, List, Optional, Tuple
 
-from flask import Flask, request, jsonify
-from werkzeug.serving import make_server
-import threading
+import msgspec
+import orjson
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import Response
+
+import hand_tracking_binlog as binlog
 
 # Setup logging
 logging.basicConfig(
@@ -22,164 +31,321 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-app = Flask(__name__)
+# Log file buffering: flush to disk every FLUSH_EVERY messages
+LOG_BUFFER_SIZE = 65536
+FLUSH_EVERY = 64
+
+# Only summarize every LOG_EVERY-th message on the /control path
+LOG_EVERY = 30
+
+# Pre-built bodies for hot fixed-shape responses
+CONTROL_ACK = b'{"status":"ok","message_index":%d,"timestamp":%.6f}'
+BATCH_ACK = b'{"status":"ok","message_index":%d,"accepted":%d,"timestamp":%.6f}'
+HEALTH_BODY = b'{"status":"ok","message_count":%d,"uptime":%.6f,"log_file":%s}'
+
+class Hand(msgspec.Struct, forbid_unknown_fields=True):
+    """Joint positions and tracking mask for a single hand."""
+    joints: List[Tuple[float, float, float]]
+    trackedMask: int = 0
+
+class HandFrame(msgspec.Struct, omit_defaults=True, forbid_unknown_fields=True):
+    """Payload sent by the Vision Pro app to /control. Unknown fields are rejected."""
+    timestamp: Optional[float] = None
+    leftHand: Optional[Hand] = None
+    rightHand: Optional[Hand] = None
+
+# Decoders are built once; they parse and validate request bodies in a single pass
+frame_decoder = msgspec.json.Decoder(HandFrame)
+batch_decoder = msgspec.json.Decoder(List[HandFrame])
+msgpack_frame_decoder = msgspec.msgpack.Decoder(HandFrame)
+msgpack_batch_decoder = msgspec.msgpack.Decoder(List[HandFrame])
+
+MSGPACK_CONTENT_TYPES = ('application/msgpack', 'application/x-msgpack')
+
+def json_response(content: Any, status_code: int = 200) -> Response:
+    """Encode content with orjson into a JSON response."""
+    return Response(orjson.dumps(content), status_code=status_code, media_type='application/json')
+
+def is_msgpack(request: Request) -> bool:
+    """Whether the request body is MessagePack rather than JSON."""
+    content_type = request.headers.get('content-type', '')
+    return content_type.split(';', 1)[0].strip() in MSGPACK_CONTENT_TYPES
 
 class HandTrackingServer:
-    def __init__(self, host: str = "0.0.0.0", port: int = 5000, log_dir: str = "./logs"):
+    def __init__(self, host: str = "0.0.0.0", port: int = 5000, log_dir: str = "./logs",
+                 log_format: str = "json"):
         self.host = host
         self.port = port
+        self.log_format = log_format
         self.log_dir = Path(log_dir)
         self.log_dir.mkdir(exist_ok=True)
         
         # Current log file
         self.log_file: Optional[Path] = None
+        self.log_file_json = b'null'
         self.log_handle = None
         self.message_count = 0
         self.start_time = None
+        self.unflushed_count = 0
+        self.warned_no_log = False
+        
+        # Background log writer
+        self.write_queue: queue.SimpleQueue = queue.SimpleQueue()
+        self.writer_thread: Optional[threading.Thread] = None
         
-        # Server
-        self.server = None
-        self.server_thread = None
+        # Don't lose buffered entries if the process exits without a clean shutdown
+        atexit.register(self.flush_log)
         
     def start_new_log(self):
         """Start a new log file for this session."""
-        if self.log_handle:
-            self.log_handle.close()
-            
         timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        self.log_file = self.log_dir / f"hand_tracking_{timestamp}.json"
-        self.log_handle = open(self.log_file, 'w')
+        self.log_file = self.log_dir / f"hand_tracking_{timestamp}.{self.log_format}"
+        self.log_file_json = orjson.dumps(str(self.log_file))
         self.message_count = 0
         self.start_time = time.time()
         
-        # Write metadata
-        metadata = {
-            "type": "metadata",
-            "timestamp": self.start_time,
-            "datetime": datetime.now().isoformat(),
-            "version": "1.0"
-        }
-        self.log_handle.write(json.dumps(metadata) + '\n')
-        self.log_handle.flush()
+        # The file is swapped on the writer thread, in order with queued entries
+        self.write_queue.put_nowait(functools.partial(self._open_log, self.log_file, self.start_time))
         
         logger.info(f"Started new log: {self.log_file}")
         
-    def log_data(self, data: Dict[str, Any]):
-        """Log received data to file."""
-        if not self.log_handle:
-            self.start_new_log()
+    def _open_log(self, log_file: Path, start_time: float):
+        """Close the current log and open log_file (runs on the writer thread)."""
+        if self.log_handle:
+            self.log_handle.close()
             
-        # Add server timestamp and message count
-        log_entry = {
-            "server_timestamp": time.time(),
-            "message_index": self.message_count,
-            "data": data
-        }
-        
-        self.log_handle.write(json.dumps(log_entry) + '\n')
-        self.log_handle.flush()
-        self.message_count += 1
+        # If open() fails, entries are skipped until the next log is opened
+        self.log_handle = None
+        self.log_handle = open(log_file, 'wb', buffering=LOG_BUFFER_SIZE)
+        self.unflushed_count = 0
+        self.warned_no_log = False
         
-    def run(self):
-        """Run the Flask server."""
-        self.server = make_server(self.host, self.port, app)
-        logger.info(f"HTTP server started on http://{self.host}:{self.port}")
-        logger.info(f"Logging data to: {self.log_dir}")
+        if self.log_format == "bin":
+            self.log_handle.write(binlog.encode_header())
+        else:
+            # Write metadata
+            metadata = {
+                "type": "metadata",
+                "timestamp": start_time,
+                "datetime": datetime.now().isoformat(),
+                "version": "1.0"
+            }
+            self.log_handle.write(orjson.dumps(metadata) + b'\n')
+        self.log_handle.flush()
         
-        # Start server in thread
-        self.server_thread = threading.Thread(target=self.server.serve_forever)
-        self.server_thread.daemon = True
-        self.server_thread.start()
+    def _close_log(self, total_messages: int, duration: float):
+        """Write session end metadata and close the log (runs on the writer thread)."""
+        if not self.log_handle:
+            return
         
-        try:
-            # Keep main thread alive
-            while True:
-                time.sleep(1)
-        except KeyboardInterrupt:
-            logger.info("Shutting down server...")
-            self.shutdown()
-            
-    def shutdown(self):
-        """Shutdown the server and close log file."""
-        if self.server:
-            self.server.shutdown()
-            
-        if self.log_handle:
+        if self.log_format == "json":
             # Write closing metadata
             metadata = {
                 "type": "session_end",
                 "timestamp": time.time(),
                 "datetime": datetime.now().isoformat(),
-                "total_messages": self.message_count,
-                "duration": time.time() - self.start_time if self.start_time else 0
+                "total_messages": total_messages,
+                "duration": duration
             }
-            self.log_handle.write(json.dumps(metadata) + '\n')
-            self.log_handle.close()
+            self.log_handle.write(orjson.dumps(metadata) + b'\n')
+        self.log_handle.close()
+        
+    def log_data(self, data: Dict[str, Any]):
+        """Queue received data to be written to the log file."""
+        if self.log_file is None:
+            self.start_new_log()
+            
+        # Serialization and disk I/O happen on the writer thread
+        self.write_queue.put_nowait((time.time(), self.message_count, data))
+        self.message_count += 1
+        
+    def start_writer(self):
+        """Start the background thread that writes queued log entries."""
+        self.writer_thread = threading.Thread(target=self._writer_loop, daemon=True)
+        self.writer_thread.start()
+        
+    def _writer_loop(self):
+        """Serialize and write queued entries until a stop sentinel arrives."""
+        while True:
+            item = self.write_queue.get()
+            if item is None:
+                break
+            if callable(item):
+                # Log file open/close commands
+                try:
+                    item()
+                except Exception as e:
+                    logger.error(f"Failed to manage log file: {e}")
+                continue
+                
+            if self.log_handle is None:
+                if not self.warned_no_log:
+                    logger.warning("No log file open, dropping entries until the next log is started")
+                    self.warned_no_log = True
+                continue
+                
+            server_timestamp, message_index, data = item
+            try:
+                if self.log_format == "bin":
+                    self.log_handle.write(binlog.encode_record(server_timestamp, message_index, data))
+                else:
+                    log_entry = {
+                        "server_timestamp": server_timestamp,
+                        "message_index": message_index,
+                        "data": data
+                    }
+                    self.log_handle.write(orjson.dumps(log_entry) + b'\n')
+            except Exception as e:
+                logger.error(f"Failed to write log data: {e}")
+                continue
+                
+            self.unflushed_count += 1
+            if self.unflushed_count >= FLUSH_EVERY:
+                self.flush_log()
+                
+    def flush_log(self):
+        """Flush buffered log lines to disk."""
+        if self.log_handle and not self.log_handle.closed:
+            self.log_handle.flush()
+        self.unflushed_count = 0
+        
+    async def shutdown(self):
+        """Write pending entries, close log file and stop the writer."""
+        if self.writer_thread is None:
+            return
+            
+        if self.log_file is not None:
+            duration = time.time() - self.start_time if self.start_time else 0
+            self.write_queue.put_nowait(functools.partial(self._close_log, self.message_count, duration))
+        self.write_queue.put_nowait(None)
+        await asyncio.to_thread(self.writer_thread.join)
+        
+        if self.log_file is not None:
             logger.info(f"Session ended. Total messages: {self.message_count}")
 
 # Global server instance
 server = HandTrackingServer()
 
-# Flask routes
-@app.route('/health', methods=['GET'])
-def health():
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    """Run the log writer for the lifetime of the app."""
+    server.start_writer()
+    logger.info(f"HTTP server started on http://{server.host}:{server.port}")
+    logger.info(f"Logging data to: {server.log_dir}")
+    try:
+        yield
+    finally:
+        logger.info("Shutting down server...")
+        await server.shutdown()
+
+app = FastAPI(lifespan=lifespan)
+
+# Routes
+@app.get('/health')
+async def health():
     """Health check endpoint."""
-    return jsonify({
-        "status": "ok",
-        "message_count": server.message_count,
-        "uptime": time.time() - server.start_time if server.start_time else 0,
-        "log_file": str(server.log_file) if server.log_file else None
-    })
+    uptime = time.time() - server.start_time if server.start_time else 0
+    return Response(
+        HEALTH_BODY % (server.message_count, uptime, server.log_file_json),
+        media_type='application/json'
+    )
 
-@app.route('/control', methods=['POST'])
-def control():
+@app.post('/control')
+async def control(request: Request):
     """Main endpoint for receiving hand tracking data."""
     try:
-        data = request.get_json()
+        try:
+            decoder = msgpack_frame_decoder if is_msgpack(request) else frame_decoder
+            frame = decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            return json_response({"error": f"Invalid hand data: {e}"}, status_code=400)
+            
+        data = msgspec.to_builtins(frame)
         if not data:
-            return jsonify({"error": "No JSON data provided"}), 400
+            return json_response({"error": "No JSON data provided"}, status_code=400)
+        if server.log_format == "bin":
+            try:
+                binlog.check_frame(data)
+            except ValueError as e:
+                return json_response({"error": f"Invalid hand data for binary log: {e}"}, status_code=400)
         
         # Log the data
         server.log_data(data)
         
         # Print summary
-        if 'leftHand' in data or 'rightHand' in data:
-            hands = []
-            if data.get('leftHand'):
-                hands.append("left")
-            if data.get('rightHand'):
-                hands.append("right")
-            logger.info(f"Received hand data: {', '.join(hands)} - Message #{server.message_count}")
-        else:
-            logger.info(f"Received data - Message #{server.message_count}")
+        if server.message_count % LOG_EVERY == 0 and logger.isEnabledFor(logging.INFO):
+            if 'leftHand' in data or 'rightHand' in data:
+                hands = []
+                if data.get('leftHand'):
+                    hands.append("left")
+                if data.get('rightHand'):
+                    hands.append("right")
+                logger.info("Received hand data: %s - Message #%d", ', '.join(hands), server.message_count)
+            else:
+                logger.info("Received data - Message #%d", server.message_count)
         
-        return jsonify({
-            "status": "ok",
-            "message_index": server.message_count,
-            "timestamp": time.time()
-        })
+        return Response(
+            CONTROL_ACK % (server.message_count, time.time()),
+            media_type='application/json'
+        )
+        
+    except Exception as e:
+        logger.error(f"Error processing request: {e}")
+        return json_response({"error": str(e)}, status_code=500)
+
+@app.post('/control/batch')
+async def control_batch(request: Request):
+    """Receive a JSON array of hand tracking messages in one request."""
+    try:
+        try:
+            decoder = msgpack_batch_decoder if is_msgpack(request) else batch_decoder
+            frames = decoder.decode(await request.body())
+        except msgspec.DecodeError as e:
+            return json_response({"error": f"Invalid hand data batch: {e}"}, status_code=400)
+            
+        batch = [data for data in map(msgspec.to_builtins, frames) if data]
+        if server.log_format == "bin":
+            try:
+                for data in batch:
+                    binlog.check_frame(data)
+            except ValueError as e:
+                return json_response({"error": f"Invalid hand data for binary log: {e}"}, status_code=400)
+                
+        for data in batch:
+            server.log_data(data)
+        accepted = len(batch)
+        
+        # Print summary when the batch crosses a LOG_EVERY boundary
+        crossed = server.message_count // LOG_EVERY > (server.message_count - accepted) // LOG_EVERY
+        if crossed and logger.isEnabledFor(logging.INFO):
+            logger.info("Received batch of %d messages - Message #%d", accepted, server.message_count)
+            
+        return Response(
+            BATCH_ACK % (server.message_count, accepted, time.time()),
+            media_type='application/json'
+        )
         
     except Exception as e:
         logger.error(f"Error processing request: {e}")
-        return jsonify({"error": str(e)}), 500
+        return json_response({"error": str(e)}, status_code=500)
 
-@app.route('/status', methods=['GET'])
-def status():
+@app.get('/status')
+async def status():
     """Get server status."""
-    return jsonify({
+    return json_response({
         "status": "running",
         "message_count": server.message_count,
         "current_log": str(server.log_file) if server.log_file else None,
         "uptime": time.time() - server.start_time if server.start_time else 0
     })
 
-@app.route('/reset', methods=['POST'])
-def reset():
+@app.post('/reset')
+async def reset():
     """Start a new log file."""
     old_count = server.message_count
     server.start_new_log()
     
-    return jsonify({
+    return json_response({
         "status": "reset",
         "previous_message_count": old_count,
         "new_log_file": str(server.log_file)
@@ -192,12 +358,22 @@ def main():
     parser.add_argument('--host', default='0.0.0.0', help='Host to bind to')
     parser.add_argument('--port', type=int, default=5000, help='Port to bind to')
     parser.add_argument('--log-dir', default='./logs', help='Directory to save logs')
+    parser.add_argument('--log-format', choices=['json', 'bin'], default='json',
+                        help='Log as NDJSON or as fixed-size binary records')
     
     args = parser.parse_args()
     
     global server
-    server = HandTrackingServer(host=args.host, port=args.port, log_dir=args.log_dir)
-    server.run()
+    server = HandTrackingServer(host=args.host, port=args.port, log_dir=args.log_dir,
+                                log_format=args.log_format)
+    uvicorn.run(
+        app,
+        host=args.host,
+        port=args.port,
+        loop="uvloop",
+        http="httptools",
+        log_level="warning"
+    )
 
 if __name__ == '__main__':
     main()
\ No newline at end of file